@@ -3,66 +3,70 @@ DuckDB Google Trends - CLI
 """
 
 import argparse
+import os
 import sys
 from pathlib import Path
 
-# Add src to path
-sys.path.insert(0, str(Path(__file__).parent / "src"))
+# Command modules (httpx, duckdb, pandas) are imported inside the cmd_*
+# handlers so each invocation only pays for what its subcommand uses
 
-from scraper import fetch_snapshots
-from analytics import SERPAnalytics
-from duckdb_manager import DuckDBManager
+# Markdown cell escaping: pipes would split the cell, newlines would end the row
+_MD_TT = str.maketrans({'|': '\\|', '\n': ' ', '\r': ''})
 
 
-def df_to_markdown(df, max_cell_length=200): # max_cell_length is the maximum length of a cell in the markdown table
-    """Convert DataFrame to markdown table format"""
-    if len(df) == 0:
-        return ""
+def iter_markdown(df, max_cell_length=200, copy=True): # max_cell_length is the maximum length of a cell in the markdown table
+    """Yield a DataFrame as markdown table lines (header, separator, then one line per row)
     
-    # Truncate long text fields
-    df_display = df.copy()
-    for col in df_display.columns:
-        if df_display[col].dtype == 'object':
-            df_display[col] = df_display[col].astype(str).apply(
-                lambda x: x[:max_cell_length] + '...' if len(x) > max_cell_length else x
-            )
+    With copy=False the text columns of df are truncated/escaped in place.
+    """
+    if len(df) == 0:
+        return
     
-    # Build markdown table
-    lines = []
+    # Truncate long text fields and escape pipes/newlines in cells
+    df_display = df.copy() if copy else df
+    for col in df_display.select_dtypes(include=['object', 'string']).columns:
+        s = df_display[col].astype(str)
+        truncated = s.str.len() > max_cell_length
+        s = s.str.slice(0, max_cell_length).str.translate(_MD_TT)
+        df_display[col] = s.where(~truncated, s + '...')
     
     # Header
-    headers = '| ' + ' | '.join(df_display.columns) + ' |'
-    lines.append(headers)
+    yield '| ' + ' | '.join(str(col).translate(_MD_TT) for col in df_display.columns) + ' |'
     
     # Separator
-    separator = '| ' + ' | '.join(['---'] * len(df_display.columns)) + ' |'
-    lines.append(separator)
+    yield '| ' + ' | '.join(['---'] * len(df_display.columns)) + ' |'
     
     # Rows
-    for _, row in df_display.iterrows():
-        cells = []
-        for col in df_display.columns:
-            value = str(row[col])
-            # Escape pipe characters in cells
-            value = value.replace('|', '\\|')
-            cells.append(value)
-        lines.append('| ' + ' | '.join(cells) + ' |')
+    for row in df_display.itertuples(index=False, name=None):
+        yield '| ' + ' | '.join(map(str, row)) + ' |'
+
+
+def print_markdown(df):
+    """Stream a DataFrame to stdout as a markdown table, one row at a time
     
-    return '\n'.join(lines)
+    The cmd_* results are formatted in place: none of them reuses its text
+    columns after printing (the scores chart only reads dates and scores).
+    """
+    sys.stdout.writelines(line + '\n' for line in iter_markdown(df, copy=False))
 
 
 def cmd_fetch(args):
     """Fetch snapshots for keywords"""
+    from src.scraper import fetch_snapshots
+    
     keywords = args.keywords or []
     if not keywords:
         print("Error: No keywords provided")
         return
     
-    fetch_snapshots(keywords, num_results=args.num_results, delay=args.delay)
+    fetch_snapshots(keywords, num_results=args.num_results, delay=args.delay,
+                    max_workers=args.workers)
 
 
 def cmd_analyze(args):
     """Run analytics for a query"""
+    from src.analytics import SERPAnalytics
+    
     with SERPAnalytics() as analytics:
         stats = analytics.summary_stats(args.query)
         
@@ -76,8 +80,11 @@ def cmd_analyze(args):
 
 def cmd_volatility(args):
     """Show rank volatility"""
+    from src.analytics import SERPAnalytics
+    
     with SERPAnalytics() as analytics:
-        result = analytics.rank_volatility(args.query, days=args.days)
+        result = analytics.rank_volatility(args.query, days=args.days,
+                                           approximate=args.approximate)
         
         print(f"\n=== Rank Volatility for '{result['query']}' (last {result['days']} days) ===")
         if len(result['results']) == 0:
@@ -85,11 +92,13 @@ def cmd_volatility(args):
             return
         
         print(f"\nTop {len(result['results'])} most volatile URLs:\n")
-        print(df_to_markdown(result['results']))
+        print_markdown(result['results'])
 
 
 def cmd_new_entrants(args):
     """Show new entrants"""
+    from src.analytics import SERPAnalytics
+    
     with SERPAnalytics() as analytics:
         result = analytics.new_entrants(args.query, days=args.days)
         
@@ -99,13 +108,16 @@ def cmd_new_entrants(args):
             return
         
         print(f"\nFound {len(result['results'])} new URLs:\n")
-        print(df_to_markdown(result['results']))
+        print_markdown(result['results'])
 
 
 def cmd_changes(args):
     """Show title/snippet changes"""
+    from src.analytics import SERPAnalytics
+    
     with SERPAnalytics() as analytics:
-        result = analytics.content_changes(args.query, days=args.days)
+        result = analytics.content_changes(args.query, days=args.days,
+                                           approximate=args.approximate)
         
         print(f"\n=== Content Changes for '{result['query']}' (last {result['days']} days) ===")
         if len(result['results']) == 0:
@@ -113,22 +125,34 @@ def cmd_changes(args):
             return
         
         print(f"\nFound {len(result['results'])} changes:\n")
-        print(df_to_markdown(result['results']))
+        print_markdown(result['results'])
+
+
+def _score_keyword(db, keyword):
+    """Calculate interest scores for one keyword on its own cursor"""
+    with db.cursor() as worker:
+        return worker.calculate_all_interest_scores(query=keyword)
 
 
 def cmd_calculate_scores(args):
     """Calculate interest scores for existing snapshots"""
+    from concurrent.futures import ThreadPoolExecutor
+    from src.duckdb_manager import DuckDBManager
+    
     keywords = args.keywords or []
     
     with DuckDBManager() as db:
         if keywords:
             print(f"Calculating interest scores for {len(keywords)} keywords...")
             total = 0
-            for keyword in keywords:
-                count = db.calculate_all_interest_scores(query=keyword)
-                total += count
-                if count > 0:
-                    print(f"  '{keyword}': {count} scores calculated")
+            # Keywords are independent; DuckDB runs each worker's cursor without the GIL
+            workers = min(len(keywords), os.cpu_count() or 1)
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                counts = executor.map(lambda keyword: _score_keyword(db, keyword), keywords)
+                for keyword, count in zip(keywords, counts):
+                    total += count
+                    if count > 0:
+                        print(f"  '{keyword}': {count} scores calculated")
         else:
             print("Calculating interest scores for all keywords...")
             total = db.calculate_all_interest_scores()
@@ -139,37 +163,114 @@ def cmd_calculate_scores(args):
             print("Fetch snapshots on multiple days to build historical data.")
 
 
+_MPL = None
+_FIG, _AX = None, None
+CHART_CACHE_DIR = Path.home() / ".cache" / "duckdb-gtrends"
+# Least recently used charts beyond this many are pruned after each render
+CHART_CACHE_MAX_FILES = 200
+
+
+def _get_mpl():
+    """Import matplotlib once and return (pyplot, dates)"""
+    global _MPL
+    if _MPL is None:
+        import matplotlib
+        matplotlib.use('Agg')  # Non-interactive backend
+        import matplotlib.pyplot as plt
+        import matplotlib.dates as mdates
+        _MPL = (plt, mdates)
+    return _MPL
+
+
+def _get_chart_axes():
+    """Return the reusable (figure, axes) pair for score charts, cleared for a new plot"""
+    global _FIG, _AX
+    plt, _ = _get_mpl()
+    if _FIG is None:
+        _FIG, _AX = plt.subplots(figsize=(12, 6), dpi=150)
+    else:
+        _AX.cla()
+    return _FIG, _AX
+
+
+def _parse_chart_dates(values):
+    """Parse snapshot dates to datetime64 (DATE, datetime and ISO strings)"""
+    from datetime import datetime, timezone
+    import pandas as pd
+    
+    # One vectorized pass covers every well-formed value; utc=True lets naive
+    # and offset-aware ('Z', '+02:00') values mix, and all come back naive UTC
+    dates = pd.to_datetime(values, format='mixed', errors='coerce', utc=True).dt.tz_convert(None)
+    
+    # Per-row fallback for strings pandas could not infer, via the C fromisoformat parser
+    for i in dates.index[dates.isna() & values.notna()]:
+        d_str = str(values[i]).strip()
+        try:
+            parsed = datetime.fromisoformat(d_str.replace('Z', '+00:00'))
+        except ValueError:
+            parsed = datetime.fromisoformat(d_str.split()[0])
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        dates[i] = parsed
+    
+    return dates
+
+
+def _chart_cache_path(df, query, days):
+    """Cache file for a chart, keyed by the query, window and plotted rows"""
+    import hashlib
+    import pandas as pd
+    
+    row_hash = pd.util.hash_pandas_object(df, index=False).values.tobytes()
+    key = hashlib.blake2b(row_hash + f"{query}|{days}".encode(), digest_size=16).hexdigest()
+    return CHART_CACHE_DIR / f"{key}.png"
+
+
+def _prune_chart_cache(max_files=CHART_CACHE_MAX_FILES):
+    """Delete the least recently used cached charts beyond max_files"""
+    import time
+    
+    # Temporary renders left behind by killed runs
+    for path in CHART_CACHE_DIR.glob('*.png.tmp'):
+        try:
+            if path.stat().st_mtime < time.time() - 3600:
+                path.unlink()
+        except FileNotFoundError:
+            pass
+    
+    entries = []
+    for path in CHART_CACHE_DIR.glob('*.png'):
+        try:
+            entries.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            continue
+    entries.sort(reverse=True)
+    for _, path in entries[max_files:]:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
 def _generate_png_chart(df, query, days, output_path):
-    """Generate PNG chart using matplotlib"""
-    import matplotlib
-    matplotlib.use('Agg')  # Non-interactive backend
-    import matplotlib.pyplot as plt
-    import matplotlib.dates as mdates
-    from datetime import datetime
-    
-    # Handle date formatting
-    dates = []
-    for d in df['snapshot_date']:
-        if isinstance(d, datetime):
-            dates.append(d)
-        elif isinstance(d, str):
-            d_str = d.strip()
-            try:
-                if ' ' in d_str or 'T' in d_str:
-                    if 'T' in d_str:
-                        dates.append(datetime.fromisoformat(d_str.replace('Z', '+00:00')))
-                    else:
-                        dates.append(datetime.strptime(d_str, '%Y-%m-%d %H:%M:%S'))
-                else:
-                    dates.append(datetime.strptime(d_str, '%Y-%m-%d'))
-            except ValueError:
-                dates.append(datetime.strptime(d_str.split()[0], '%Y-%m-%d'))
-        else:
-            dates.append(datetime.combine(d, datetime.min.time()) if hasattr(d, 'date') else datetime.fromisoformat(str(d)))
+    """Generate PNG chart using matplotlib (reuses a cached PNG for identical data)"""
+    import shutil
+    import tempfile
+    
+    cache_path = _chart_cache_path(df, query, days)
+    if cache_path.exists():
+        shutil.copyfile(cache_path, output_path)
+        # Mark as recently used so pruning keeps it
+        os.utime(cache_path)
+        return
+    
+    _, mdates = _get_mpl()
+    
+    dates = _parse_chart_dates(df['snapshot_date']).dt.to_pydatetime()
     
     scores = df['interest_score'].astype(float).values
     
-    fig, ax = plt.subplots(figsize=(12, 6))
+    fig, ax = _get_chart_axes()
     ax.plot(dates, scores, marker='o', linewidth=2, markersize=4, label=query)
     
     ax.set_xlabel('Date', fontsize=12)
@@ -182,15 +283,98 @@ def _generate_png_chart(df, query, days, output_path):
     # Format x-axis dates
     ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
     ax.xaxis.set_major_locator(mdates.DayLocator(interval=max(1, days // 10)))
-    plt.xticks(rotation=45)
-    plt.tight_layout()
+    ax.tick_params(axis='x', labelrotation=45)
+    fig.tight_layout()
+    
+    CHART_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    # Render to a temporary file and rename it into place, so an interrupted
+    # or concurrent run never leaves a truncated PNG as a cache entry
+    fd, tmp_path = tempfile.mkstemp(dir=CHART_CACHE_DIR, suffix='.png.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            # Layout is already tight, so render once straight through the Agg canvas
+            # (bbox_inches='tight' would cost an extra full draw to measure the bbox)
+            fig.canvas.print_png(tmp_file)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    shutil.copyfile(cache_path, output_path)
+    _prune_chart_cache()
+
+
+def _generate_png_chart_fast(df, query, days, output_path):
+    """Generate PNG chart by drawing it directly with Pillow (no matplotlib)"""
+    import pandas as pd
+    from PIL import Image, ImageDraw, ImageFont
+    
+    # Same canvas as the matplotlib chart: 12x6 inches at 150 dpi
+    width, height = 1800, 900
+    left, right, top, bottom = 150, 60, 90, 130
+    plot_w, plot_h = width - left - right, height - top - bottom
     
-    plt.savefig(output_path, dpi=150, bbox_inches='tight')
-    plt.close()
+    dates = _parse_chart_dates(df['snapshot_date'])
+    scores = df['interest_score'].astype(float).clip(0, 100).values
+    
+    # Scale dates (in days) and scores (0-100) linearly onto the plot area
+    day_offsets = (dates - dates.min()).dt.total_seconds().values / 86400
+    span = max(day_offsets.max(), 1)
+    xs = left + day_offsets / span * plot_w
+    ys = top + plot_h - scores / 100 * plot_h
+    
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default(size=20)
+    title_font = ImageFont.load_default(size=28)
+    
+    # Horizontal grid with y tick labels
+    for value in range(0, 101, 20):
+        y = top + plot_h - value / 100 * plot_h
+        draw.line([(left, y), (left + plot_w, y)], fill=(225, 225, 225), width=1)
+        draw.text((left - 12, y), str(value), fill='black', font=font, anchor='rm')
+    
+    # Date ticks along the x axis
+    interval = max(1, days // 10)
+    tick = dates.min().normalize()
+    while tick <= dates.max():
+        x = left + (tick - dates.min()).total_seconds() / 86400 / span * plot_w
+        draw.line([(x, top + plot_h), (x, top + plot_h + 8)], fill='black', width=2)
+        draw.text((x, top + plot_h + 14), tick.strftime('%Y-%m-%d'), fill='black', font=font, anchor='mt')
+        tick += pd.Timedelta(days=interval)
+    
+    draw.rectangle([left, top, left + plot_w, top + plot_h], outline='black', width=2)
+    
+    # Trend line with markers
+    points = list(zip(xs.tolist(), ys.tolist()))
+    if len(points) > 1:
+        draw.line(points, fill=(31, 119, 180), width=4, joint='curve')
+    for x, y in points:
+        draw.ellipse([x - 6, y - 6, x + 6, y + 6], fill=(31, 119, 180))
+    
+    draw.text((width / 2, top / 2), f'Search Interest Trend: {query} ({days} days)',
+              fill='black', font=title_font, anchor='mm')
+    draw.text((left + plot_w / 2, height - 40), 'Date', fill='black', font=font, anchor='mm')
+    draw.text((40, top + plot_h / 2), 'Score', fill='black', font=font, anchor='mm')
+    
+    img.save(output_path, optimize=True)
+
+
+def _optimize_png(path):
+    """Losslessly recompress a PNG with oxipng, if it is installed"""
+    import shutil
+    import subprocess
+    
+    oxipng = shutil.which('oxipng')
+    if not oxipng:
+        return False
+    subprocess.run([oxipng, '-o', '2', '--strip', 'safe', '--quiet', str(path)], check=False)
+    return True
 
 
 def cmd_scores(args):
     """Show interest scores for a query"""
+    from src.analytics import SERPAnalytics
+    
     with SERPAnalytics() as analytics:
         result = analytics.interest_scores(args.query, days=args.days)
         
@@ -203,11 +387,16 @@ def cmd_scores(args):
             return
         
         print(f"\nFound {len(result['results'])} scores:\n")
-        print(df_to_markdown(result['results']))
+        print_markdown(result['results'])
         
         # Generate PNG chart
         output_path = args.output or f"{args.query.replace(' ', '_')}_trend.png"
-        _generate_png_chart(result['results'], args.query, args.days, output_path)
+        if args.fast_chart:
+            _generate_png_chart_fast(result['results'], args.query, args.days, output_path)
+        else:
+            _generate_png_chart(result['results'], args.query, args.days, output_path)
+        if args.optimize_png and not _optimize_png(output_path):
+            print("Note: oxipng not found, PNG left unoptimized")
         print(f"\nChart saved to: {output_path}")
 
 
@@ -220,6 +409,7 @@ def main():
     fetch_parser.add_argument('--keywords', nargs='+', help='Keywords to track')
     fetch_parser.add_argument('--num-results', type=int, default=10, help='Results per keyword')
     fetch_parser.add_argument('--delay', type=float, default=1.0, help='Delay between requests (seconds)')
+    fetch_parser.add_argument('--workers', type=int, default=8, help='Maximum concurrent requests')
     
     # Analyze command
     analyze_parser = subparsers.add_parser('analyze', help='Show summary statistics')
@@ -229,6 +419,7 @@ def main():
     vol_parser = subparsers.add_parser('volatility', help='Show rank volatility')
     vol_parser.add_argument('--query', required=True, help='Query keyword')
     vol_parser.add_argument('--days', type=int, default=30, help='Days to analyze')
+    vol_parser.add_argument('--approximate', action='store_true', help='Use a sample of the history (faster preview)')
     
     # New entrants command
     new_parser = subparsers.add_parser('new-entrants', help='Show new URLs')
@@ -239,6 +430,7 @@ def main():
     changes_parser = subparsers.add_parser('changes', help='Show title/snippet changes')
     changes_parser.add_argument('--query', required=True, help='Query keyword')
     changes_parser.add_argument('--days', type=int, default=30, help='Days to analyze')
+    changes_parser.add_argument('--approximate', action='store_true', help='Use a sample of the history (faster preview)')
     
     # Calculate scores command
     calc_parser = subparsers.add_parser('calculate-scores', help='Calculate interest scores for existing snapshots')
@@ -249,6 +441,8 @@ def main():
     scores_parser.add_argument('--query', required=True, help='Query keyword')
     scores_parser.add_argument('--days', type=int, default=90, help='Days to analyze')
     scores_parser.add_argument('--output', type=str, help='Output PNG file path (default: {query}_trend.png)')
+    scores_parser.add_argument('--fast-chart', action='store_true', help='Draw the PNG directly with Pillow instead of matplotlib')
+    scores_parser.add_argument('--optimize-png', action='store_true', help='Losslessly shrink the PNG with oxipng (if installed)')
     
     args = parser.parse_args()
     
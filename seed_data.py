@@ -4,18 +4,19 @@ Self-contained: inserts static data only.
 """
 
 import sys
-from pathlib import Path
 from datetime import datetime, timedelta
 
-sys.path.insert(0, str(Path(__file__).parent / "src"))
-from duckdb_manager import DuckDBManager
+from src.duckdb_manager import DuckDBManager
+
+# Unshuffled rank order, shared by every day that uses it
+_ORDER_DEFAULT = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
 
 # Static snapshot data: list of {query, date, results}
 # Each results entry: {url, title, snippet}
 # Order varies by day to produce interest score variation
 STATIC_SNAPSHOTS = [
     # nextjs
-    {"query": "nextjs", "date": "2024-01-01", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "nextjs", "date": "2024-01-01", "order": _ORDER_DEFAULT},
     {"query": "nextjs", "date": "2024-01-02", "order": [0, 2, 1, 3, 4, 5, 6, 7, 8, 9]},
     {"query": "nextjs", "date": "2024-01-03", "order": [0, 1, 2, 4, 3, 5, 6, 7, 8, 9]},
     {"query": "nextjs", "date": "2024-01-04", "order": [1, 0, 2, 3, 4, 5, 6, 7, 8, 9]},
@@ -23,7 +24,7 @@ STATIC_SNAPSHOTS = [
     {"query": "nextjs", "date": "2024-01-06", "order": [0, 1, 2, 3, 4, 5, 6, 8, 7, 9]},
     {"query": "nextjs", "date": "2024-01-07", "order": [0, 1, 2, 3, 4, 5, 6, 7, 9, 8]},
     # react
-    {"query": "react", "date": "2024-01-01", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "react", "date": "2024-01-01", "order": _ORDER_DEFAULT},
     {"query": "react", "date": "2024-01-02", "order": [0, 2, 1, 3, 4, 5, 6, 7, 8, 9]},
     {"query": "react", "date": "2024-01-03", "order": [2, 0, 1, 3, 4, 5, 6, 7, 8, 9]},
     {"query": "react", "date": "2024-01-04", "order": [0, 1, 3, 2, 4, 5, 6, 7, 8, 9]},
@@ -31,20 +32,20 @@ STATIC_SNAPSHOTS = [
     {"query": "react", "date": "2024-01-06", "order": [0, 1, 2, 3, 4, 6, 5, 7, 8, 9]},
     {"query": "react", "date": "2024-01-07", "order": [0, 1, 2, 3, 4, 5, 6, 7, 9, 8]},
     # vue
-    {"query": "vue", "date": "2024-01-01", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "vue", "date": "2024-01-01", "order": _ORDER_DEFAULT},
     {"query": "vue", "date": "2024-01-02", "order": [0, 2, 1, 3, 4, 5, 6, 7, 8, 9]},
-    {"query": "vue", "date": "2024-01-03", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "vue", "date": "2024-01-03", "order": _ORDER_DEFAULT},
     {"query": "vue", "date": "2024-01-04", "order": [1, 0, 2, 3, 4, 5, 6, 7, 8, 9]},
     {"query": "vue", "date": "2024-01-05", "order": [0, 1, 2, 4, 3, 5, 6, 7, 8, 9]},
-    {"query": "vue", "date": "2024-01-06", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "vue", "date": "2024-01-06", "order": _ORDER_DEFAULT},
     {"query": "vue", "date": "2024-01-07", "order": [0, 1, 2, 3, 4, 5, 6, 8, 7, 9]},
     # angular
-    {"query": "angular", "date": "2024-01-01", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
-    {"query": "angular", "date": "2024-01-02", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "angular", "date": "2024-01-01", "order": _ORDER_DEFAULT},
+    {"query": "angular", "date": "2024-01-02", "order": _ORDER_DEFAULT},
     {"query": "angular", "date": "2024-01-03", "order": [0, 2, 1, 3, 4, 5, 6, 7, 8, 9]},
-    {"query": "angular", "date": "2024-01-04", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "angular", "date": "2024-01-04", "order": _ORDER_DEFAULT},
     {"query": "angular", "date": "2024-01-05", "order": [0, 1, 2, 3, 5, 4, 6, 7, 8, 9]},
-    {"query": "angular", "date": "2024-01-06", "order": [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]},
+    {"query": "angular", "date": "2024-01-06", "order": _ORDER_DEFAULT},
     {"query": "angular", "date": "2024-01-07", "order": [0, 1, 2, 3, 4, 5, 6, 7, 9, 8]},
 ]
 
@@ -101,25 +102,45 @@ QUERY_BASES = {
 }
 
 
+# Flatten each base to a tuple of interned (url, title, snippet) rows once at
+# import, so every generated result dict shares one string object per value
+QUERY_BASES = {
+    query: tuple((sys.intern(r["url"]), sys.intern(r["title"]), sys.intern(r["snippet"])) for r in rows)
+    for query, rows in QUERY_BASES.items()
+}
+
+
 def _build_results(query: str, order: list) -> list:
-    base = QUERY_BASES[query]
+    rows = QUERY_BASES[query]
     return [
-        {"url": base[i]["url"], "title": base[i]["title"], "snippet": base[i]["snippet"]}
-        for i in order
+        {"url": url, "title": title, "snippet": snippet}
+        for url, title, snippet in map(rows.__getitem__, order)
     ]
 
 
 def seed_data(reset: bool = False):
     """Insert static synthetic data into the database."""
     with DuckDBManager() as db:
+        # Reset and inserts commit together (one WAL flush, nothing half-seeded)
+        db.conn.execute("BEGIN TRANSACTION")
+        try:
+            if reset:
+                db.conn.execute("DELETE FROM interest_scores")
+                db.conn.execute("DELETE FROM serp_snapshots")
+                db.clear_analytics_cache()
+            batch = [
+                (s["query"], datetime.strptime(s["date"], "%Y-%m-%d"), _build_results(s["query"], s["order"]))
+                for s in STATIC_SNAPSHOTS
+            ]
+            db.insert_snapshots_bulk(batch)
+            db.conn.execute("COMMIT")
+        except Exception:
+            db.conn.execute("ROLLBACK")
+            # Parquet written inside the transaction may describe rolled-back rows
+            db.clear_analytics_cache()
+            raise
         if reset:
-            db.conn.execute("DELETE FROM interest_scores")
-            db.conn.execute("DELETE FROM serp_snapshots")
             print("Database reset.")
-        for s in STATIC_SNAPSHOTS:
-            results = _build_results(s["query"], s["order"])
-            snapshot_date = datetime.strptime(s["date"], "%Y-%m-%d")
-            db.insert_snapshot(results, s["query"], snapshot_date=snapshot_date)
         total = db.get_snapshot_count()
         print(f"Seeded {len(STATIC_SNAPSHOTS)} snapshots. Total in DB: {total}")
 
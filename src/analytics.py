@@ -3,12 +3,210 @@ Analytics queries for SERP data
 """
 
 import duckdb
+import os
+import threading
 from typing import Dict, Any, Optional
 from datetime import datetime, timedelta
 
+from .duckdb_manager import ANALYTICS_VERSION_SQL, analytics_cache_path
+
+
+# Analytics queries ($n are positional parameters, bound on execute)
+
+# approximate=True swaps {source} for a fixed-seed reservoir sample of the
+# query's rows in the window, so the window functions see at most 10k rows.
+# It always samples the live table, so results depend only on the data.
+# The sample is drawn after filtering; a plain USING SAMPLE would sample the
+# whole table before the WHERE clause.
+SAMPLE_SIZE = 10000
+
+SAMPLED_SNAPSHOTS_SQL = f"""(
+            SELECT query, url, domain, rank, snapshot_date, title, snippet
+            FROM serp_snapshots
+            WHERE query = $1 AND snapshot_date >= $2
+        ) TABLESAMPLE reservoir({SAMPLE_SIZE} ROWS) REPEATABLE (42)"""
+
+RANK_CHANGES_SQL = """
+    rank_changes AS (
+        SELECT 
+            url,
+            domain,
+            rank,
+            snapshot_date,
+            LAG(rank) OVER (PARTITION BY url ORDER BY snapshot_date) as prev_rank
+        FROM {source}
+        WHERE query = $1 
+          AND snapshot_date >= $2
+        ORDER BY url, snapshot_date
+    )"""
+
+# Same rows from the Parquet file DuckDBManager materializes per query ($1 is
+# its path). LAG there ran over the full history, so a previous rank only
+# counts when its date is inside the window, exactly as in the live query.
+RANK_CHANGES_PARQUET_SQL = """
+    rank_changes AS (
+        SELECT 
+            url,
+            domain,
+            rank,
+            snapshot_date,
+            CASE WHEN prev_date >= $2 THEN prev_rank END as prev_rank
+        FROM read_parquet($1)
+        WHERE snapshot_date >= $2
+    )"""
+
+VOLATILITY_SQL = """
+    volatility AS (
+        SELECT 
+            url,
+            domain,
+            COUNT(*) as snapshot_count,
+            AVG(rank) as avg_rank,
+            MIN(rank) as best_rank,
+            MAX(rank) as worst_rank,
+            STDDEV(rank) as rank_stddev,
+            COUNT(CASE WHEN prev_rank IS NOT NULL AND rank != prev_rank THEN 1 END) as rank_changes
+        FROM rank_changes
+        GROUP BY url, domain
+    )
+    SELECT 
+        url,
+        domain,
+        snapshot_count,
+        ROUND(avg_rank, 2) as avg_rank,
+        best_rank,
+        worst_rank,
+        ROUND(rank_stddev, 2) as rank_stddev,
+        rank_changes,
+        ROUND(CAST(rank_changes AS DOUBLE) / NULLIF(snapshot_count - 1, 0) * 100, 1) as volatility_pct
+    FROM volatility
+    WHERE snapshot_count > 1
+    ORDER BY rank_stddev DESC, avg_rank ASC
+    LIMIT 50
+"""
+
+RANK_VOLATILITY_SQL = "WITH" + RANK_CHANGES_SQL.format(source="serp_snapshots") + "," + VOLATILITY_SQL
+RANK_VOLATILITY_APPROX_SQL = "WITH" + RANK_CHANGES_SQL.format(source=SAMPLED_SNAPSHOTS_SQL) + "," + VOLATILITY_SQL
+RANK_VOLATILITY_PARQUET_SQL = "WITH" + RANK_CHANGES_PARQUET_SQL + "," + VOLATILITY_SQL
+
+# Each URL's first row comes from one window pass over the query's rows
+# (no self-join back to serp_snapshots to recover its rank/title/snippet)
+NEW_ENTRANTS_SQL = """
+    WITH first_appearance AS (
+        SELECT 
+            url,
+            domain,
+            snapshot_date as first_seen,
+            rank as first_rank,
+            title,
+            snippet
+        FROM serp_snapshots
+        WHERE query = $1
+        QUALIFY ROW_NUMBER() OVER (PARTITION BY url, domain ORDER BY snapshot_date) = 1
+    )
+    SELECT 
+        url,
+        domain,
+        first_seen,
+        first_rank,
+        title,
+        snippet
+    FROM first_appearance
+    WHERE first_seen >= $2
+    ORDER BY first_seen DESC, first_rank ASC
+    LIMIT 50
+"""
+
+CONTENT_CHANGES_SQL = """
+    WITH changes AS (
+        SELECT 
+            url,
+            domain,
+            snapshot_date,
+            rank,
+            title,
+            snippet,
+            LAG(title) OVER w as prev_title,
+            LAG(snippet) OVER w as prev_snippet,
+            -- 64-bit hashes make the change tests integer compares; equal
+            -- text always hashes equal, so no change is reported spuriously
+            hash(title) as title_hash,
+            hash(snippet) as snippet_hash,
+            LAG(hash(title)) OVER w as prev_title_hash,
+            LAG(hash(snippet)) OVER w as prev_snippet_hash
+        FROM {source}
+        WHERE query = $1 
+          AND snapshot_date >= $2
+        WINDOW w AS (PARTITION BY url ORDER BY snapshot_date)
+    )
+    SELECT 
+        url,
+        domain,
+        snapshot_date,
+        rank,
+        prev_title,
+        title as new_title,
+        prev_snippet,
+        snippet as new_snippet,
+        CASE 
+            WHEN prev_title IS NOT NULL AND title IS NOT NULL AND title_hash <> prev_title_hash THEN 1 
+            ELSE 0 
+        END as title_changed,
+        CASE 
+            WHEN prev_snippet IS NOT NULL AND snippet IS NOT NULL AND snippet_hash <> prev_snippet_hash THEN 1 
+            ELSE 0 
+        END as snippet_changed
+    FROM changes
+    WHERE (prev_title IS NOT NULL AND title IS NOT NULL AND title_hash <> prev_title_hash)
+       OR (prev_snippet IS NOT NULL AND snippet IS NOT NULL AND snippet_hash <> prev_snippet_hash)
+    ORDER BY snapshot_date DESC, rank ASC
+    LIMIT 50
+"""
+
+CONTENT_CHANGES_APPROX_SQL = CONTENT_CHANGES_SQL.format(source=SAMPLED_SNAPSHOTS_SQL)
+CONTENT_CHANGES_SQL = CONTENT_CHANGES_SQL.format(source="serp_snapshots")
+
+INTEREST_SCORE_HISTORY_SQL = """
+    SELECT 
+        snapshot_date,
+        interest_score,
+        new_domains_count,
+        avg_rank_improvement,
+        reshuffle_frequency
+    FROM interest_scores
+    WHERE query = $1
+      AND snapshot_date >= $2
+      AND snapshot_date <= $3
+    ORDER BY snapshot_date ASC
+"""
+
+SUMMARY_STATS_SQL = """
+    SELECT 
+        COUNT(DISTINCT snapshot_date) as total_snapshots,
+        COUNT(DISTINCT url) as unique_urls,
+        COUNT(DISTINCT domain) as unique_domains,
+        MIN(snapshot_date) as first_snapshot,
+        MAX(snapshot_date) as last_snapshot
+    FROM serp_snapshots
+    WHERE query = $1
+"""
+
+
+# Database paths whose schema has been checked by this process
+_schema_ensured = set()
+
 
 def _ensure_schema_exists(db_path: str):
     """Ensure database schema exists (creates tables if needed)"""
+    key = os.path.abspath(db_path)
+    if key in _schema_ensured:
+        return
+    # A non-empty file was created by DuckDBManager, which already builds the
+    # full schema; skip the write connection so readers don't contend with it
+    if os.path.exists(db_path) and os.path.getsize(db_path) > 0:
+        _schema_ensured.add(key)
+        return
+    
     # Open in write mode temporarily to ensure schema exists
     temp_conn = duckdb.connect(db_path)
     try:
@@ -35,65 +233,93 @@ def _ensure_schema_exists(db_path: str):
             pass
     finally:
         temp_conn.close()
+    _schema_ensured.add(key)
 
 
 class SERPAnalytics:
     """Analytics queries for SERP snapshots"""
     
+    # One read-only connection per database, shared by the instances open at
+    # the same time; each instance queries through its own cursor. The
+    # connection is reference-counted and closed with its last instance, so
+    # the file is released for writers as soon as no analytics are open.
+    _conn_cache: Dict[str, list] = {}  # abspath -> [connection, open instances]
+    _conn_lock = threading.Lock()
+    
     def __init__(self, db_path: str = "data/serp_data.duckdb"):
         # Ensure schema exists before opening read-only connection
         _ensure_schema_exists(db_path)
-        self.conn = duckdb.connect(db_path, read_only=True)
+        self.db_path = db_path
+        self._conn_key = os.path.abspath(db_path)
+        self.conn = self._acquire_connection(db_path).cursor()
+    
+    @classmethod
+    def _acquire_connection(cls, db_path: str) -> duckdb.DuckDBPyConnection:
+        """Return the shared read-only connection for db_path, opening it if needed"""
+        key = os.path.abspath(db_path)
+        with cls._conn_lock:
+            entry = cls._conn_cache.get(key)
+            if entry is None:
+                entry = [duckdb.connect(db_path, read_only=True), 0]
+                cls._conn_cache[key] = entry
+            entry[1] += 1
+            return entry[0]
     
-    def rank_volatility(self, query: str, days: int = 30) -> Dict[str, Any]:
+    @classmethod
+    def _release_connection(cls, key: str):
+        """Drop one reference to a shared connection, closing it with the last one"""
+        with cls._conn_lock:
+            entry = cls._conn_cache.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del cls._conn_cache[key]
+                entry[0].close()
+    
+    @staticmethod
+    def _fetch(cursor, output_format: str):
+        """
+        Fetch a result as 'df' (pandas DataFrame), 'arrow' (pyarrow Table)
+        or 'dict' (list of row dicts)
+        """
+        if output_format == 'df':
+            return cursor.df()
+        if output_format == 'arrow':
+            # to_arrow_table() supersedes fetch_arrow_table() in newer DuckDB releases
+            to_table = getattr(cursor, 'to_arrow_table', None) or cursor.fetch_arrow_table
+            return to_table()
+        if output_format == 'dict':
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        raise ValueError(f"Unknown output_format '{output_format}' (expected 'df', 'arrow' or 'dict')")
+    
+    def rank_volatility(self, query: str, days: int = 30,
+                        approximate: bool = False,
+                        output_format: str = 'df') -> Dict[str, Any]:
         """
         Calculate rank volatility for URLs over time
         
         Returns URLs with their rank changes, standard deviation, etc.
+        With approximate=True the statistics come from a repeatable sample of
+        at most SAMPLE_SIZE rows, for quick previews of long histories.
+        output_format selects the type of 'results' (see _fetch).
         """
         cutoff_date = datetime.now().date() - timedelta(days=days)
         
-        result = self.conn.execute("""
-            WITH rank_changes AS (
-                SELECT 
-                    url,
-                    domain,
-                    rank,
-                    snapshot_date,
-                    LAG(rank) OVER (PARTITION BY url ORDER BY snapshot_date) as prev_rank
-                FROM serp_snapshots
-                WHERE query = ? 
-                  AND snapshot_date >= ?
-                ORDER BY url, snapshot_date
-            ),
-            volatility AS (
-                SELECT 
-                    url,
-                    domain,
-                    COUNT(*) as snapshot_count,
-                    AVG(rank) as avg_rank,
-                    MIN(rank) as best_rank,
-                    MAX(rank) as worst_rank,
-                    STDDEV(rank) as rank_stddev,
-                    COUNT(CASE WHEN prev_rank IS NOT NULL AND rank != prev_rank THEN 1 END) as rank_changes
-                FROM rank_changes
-                GROUP BY url, domain
-            )
-            SELECT 
-                url,
-                domain,
-                snapshot_count,
-                ROUND(avg_rank, 2) as avg_rank,
-                best_rank,
-                worst_rank,
-                ROUND(rank_stddev, 2) as rank_stddev,
-                rank_changes,
-                ROUND(CAST(rank_changes AS DOUBLE) / NULLIF(snapshot_count - 1, 0) * 100, 1) as volatility_pct
-            FROM volatility
-            WHERE snapshot_count > 1
-            ORDER BY rank_stddev DESC, avg_rank ASC
-            LIMIT 50
-        """, [query, cutoff_date]).df()
+        if approximate:
+            # Sampled from the live table only, so the cache can't change the sample
+            cursor = self.conn.execute(RANK_VOLATILITY_APPROX_SQL, [query, cutoff_date])
+        else:
+            # Prefer the Parquet history written on insert while it is current for
+            # the query's rows; otherwise (stale or missing) use the live table
+            version = tuple(self.conn.execute(ANALYTICS_VERSION_SQL, [query]).fetchone())
+            parquet_path = analytics_cache_path(self.db_path, query, version)
+            if os.path.exists(parquet_path):
+                cursor = self.conn.execute(RANK_VOLATILITY_PARQUET_SQL, [parquet_path, cutoff_date])
+            else:
+                cursor = self.conn.execute(RANK_VOLATILITY_SQL, [query, cutoff_date])
+        result = self._fetch(cursor, output_format)
         
         return {
             'query': query,
@@ -101,48 +327,15 @@ class SERPAnalytics:
             'results': result
         }
     
-    def new_entrants(self, query: str, days: int = 7) -> Dict[str, Any]:
+    def new_entrants(self, query: str, days: int = 7,
+                     output_format: str = 'df') -> Dict[str, Any]:
         """
         Find URLs that appeared for the first time in recent snapshots
         """
         cutoff_date = datetime.now().date() - timedelta(days=days)
         
-        result = self.conn.execute("""
-            WITH first_appearance AS (
-                SELECT 
-                    url,
-                    domain,
-                    MIN(snapshot_date) as first_seen
-                FROM serp_snapshots
-                WHERE query = ?
-                GROUP BY url, domain
-            ),
-            recent_entrants AS (
-                SELECT 
-                    fa.url,
-                    fa.domain,
-                    fa.first_seen,
-                    s.rank as first_rank,
-                    s.title,
-                    s.snippet
-                FROM first_appearance fa
-                JOIN serp_snapshots s 
-                    ON fa.url = s.url 
-                    AND fa.first_seen = s.snapshot_date
-                    AND s.query = ?
-                WHERE fa.first_seen >= ?
-            )
-            SELECT 
-                url,
-                domain,
-                first_seen,
-                first_rank,
-                title,
-                snippet
-            FROM recent_entrants
-            ORDER BY first_seen DESC, first_rank ASC
-            LIMIT 50
-        """, [query, query, cutoff_date]).df()
+        cursor = self.conn.execute(NEW_ENTRANTS_SQL, [query, cutoff_date])
+        result = self._fetch(cursor, output_format)
         
         return {
             'query': query,
@@ -150,50 +343,20 @@ class SERPAnalytics:
             'results': result
         }
     
-    def content_changes(self, query: str, days: int = 30) -> Dict[str, Any]:
+    def content_changes(self, query: str, days: int = 30,
+                        approximate: bool = False,
+                        output_format: str = 'df') -> Dict[str, Any]:
         """
         Detect title and snippet changes over time
+        
+        With approximate=True changes are detected within a repeatable sample
+        of at most SAMPLE_SIZE rows.
         """
         cutoff_date = datetime.now().date() - timedelta(days=days)
         
-        result = self.conn.execute("""
-            WITH changes AS (
-                SELECT 
-                    url,
-                    domain,
-                    snapshot_date,
-                    rank,
-                    title,
-                    snippet,
-                    LAG(title) OVER (PARTITION BY url ORDER BY snapshot_date) as prev_title,
-                    LAG(snippet) OVER (PARTITION BY url ORDER BY snapshot_date) as prev_snippet
-                FROM serp_snapshots
-                WHERE query = ? 
-                  AND snapshot_date >= ?
-            )
-            SELECT 
-                url,
-                domain,
-                snapshot_date,
-                rank,
-                prev_title,
-                title as new_title,
-                prev_snippet,
-                snippet as new_snippet,
-                CASE 
-                    WHEN prev_title IS NOT NULL AND title != prev_title THEN 1 
-                    ELSE 0 
-                END as title_changed,
-                CASE 
-                    WHEN prev_snippet IS NOT NULL AND snippet != prev_snippet THEN 1 
-                    ELSE 0 
-                END as snippet_changed
-            FROM changes
-            WHERE (prev_title IS NOT NULL AND title != prev_title)
-               OR (prev_snippet IS NOT NULL AND snippet != prev_snippet)
-            ORDER BY snapshot_date DESC, rank ASC
-            LIMIT 50
-        """, [query, cutoff_date]).df()
+        sql = CONTENT_CHANGES_APPROX_SQL if approximate else CONTENT_CHANGES_SQL
+        cursor = self.conn.execute(sql, [query, cutoff_date])
+        result = self._fetch(cursor, output_format)
         
         return {
             'query': query,
@@ -203,27 +366,22 @@ class SERPAnalytics:
     
     def interest_scores(self, query: str, days: int = 90, 
                         start_date: Optional[datetime] = None, 
-                        end_date: Optional[datetime] = None) -> Dict[str, Any]:
-        """Get interest scores for a query over time"""
+                        end_date: Optional[datetime] = None,
+                        output_format: str = 'df') -> Dict[str, Any]:
+        """
+        Get interest scores for a query over time
+        
+        output_format selects the type of 'results' (see _fetch).
+        """
         if start_date is not None:
             start = start_date.date() if hasattr(start_date, 'date') else start_date
         else:
             start = datetime.now().date() - timedelta(days=days)
         end = end_date.date() if end_date and hasattr(end_date, 'date') else (end_date or datetime.now().date())
         
-        result = self.conn.execute("""
-            SELECT 
-                snapshot_date,
-                interest_score,
-                new_domains_count,
-                avg_rank_improvement,
-                reshuffle_frequency
-            FROM interest_scores
-            WHERE query = ?
-              AND snapshot_date >= ?
-              AND snapshot_date <= ?
-            ORDER BY snapshot_date ASC
-        """, [query, start, end]).df()
+        cursor = self.conn.execute(INTEREST_SCORE_HISTORY_SQL, [query, start, end])
+        
+        result = self._fetch(cursor, output_format)
         
         return {
             'query': query,
@@ -233,16 +391,7 @@ class SERPAnalytics:
     
     def summary_stats(self, query: str) -> Dict[str, Any]:
         """Get summary statistics for a query"""
-        result = self.conn.execute("""
-            SELECT 
-                COUNT(DISTINCT snapshot_date) as total_snapshots,
-                COUNT(DISTINCT url) as unique_urls,
-                COUNT(DISTINCT domain) as unique_domains,
-                MIN(snapshot_date) as first_snapshot,
-                MAX(snapshot_date) as last_snapshot
-            FROM serp_snapshots
-            WHERE query = ?
-        """, [query]).fetchone()
+        result = self.conn.execute(SUMMARY_STATS_SQL, [query]).fetchone()
         
         return {
             'query': query,
@@ -254,8 +403,12 @@ class SERPAnalytics:
         }
     
     def close(self):
-        """Close database connection"""
+        """Close this instance's cursor (and the shared connection if it was the last user)"""
+        if self.conn is None:
+            return
         self.conn.close()
+        self.conn = None
+        self._release_connection(self._conn_key)
     
     def __enter__(self):
         return self
@@ -3,9 +3,156 @@ DuckDB manager for SERP snapshots
 """
 
 import duckdb
+import hashlib
 import os
-from typing import Optional, List, Dict, Any
-from datetime import datetime
+import re
+from typing import Optional, List, Dict, Any, Tuple
+from datetime import date, datetime
+
+
+# serp_snapshots columns built in Python for each insert batch
+# (snapshot_id comes from serp_snapshot_seq, domain from DOMAIN_SQL)
+SNAPSHOT_COLUMNS = (
+    'query', 'snapshot_date', 'snapshot_timestamp',
+    'url', 'title', 'snippet', 'rank',
+)
+
+# Host part of url without "www." (same result as urlparse(url).netloc.replace("www.", ""))
+DOMAIN_SQL = r"""replace(regexp_extract(url, '^(?:[A-Za-z][A-Za-z0-9+.-]*:)?//([^/?#]*)', 1), 'www.', '')"""
+
+ANALYTICS_CACHE_DIR = "cache"
+
+# Stamp identifying the state of a query's rows; it changes on every insert
+# and delete, so a cached file is only used while it matches the live table
+ANALYTICS_VERSION_SQL = """
+    SELECT COALESCE(MAX(snapshot_id), 0), COUNT(*) 
+    FROM serp_snapshots 
+    WHERE query = $1
+"""
+
+
+def analytics_cache_dir(db_path: str) -> str:
+    """Directory holding one database's materialized analytics files"""
+    db_name = os.path.splitext(os.path.basename(db_path))[0]
+    return os.path.join(os.path.dirname(db_path), ANALYTICS_CACHE_DIR, db_name)
+
+
+def analytics_cache_path(db_path: str, query: str, version: Tuple[int, int]) -> str:
+    """Parquet file with the rank history for a query at a given ANALYTICS_VERSION_SQL stamp"""
+    max_id, row_count = version
+    return os.path.join(analytics_cache_dir(db_path),
+                        f"{_analytics_cache_prefix(query)}{max_id}-{row_count}_volatility.parquet")
+
+
+def _analytics_cache_prefix(query: str) -> str:
+    """File name prefix shared by every version of a query's cache file"""
+    slug = re.sub(r'[^A-Za-z0-9_-]+', '_', query)[:50]
+    digest = hashlib.blake2b(query.encode(), digest_size=4).hexdigest()
+    return f"{slug}_{digest}_v"
+
+
+# Search Interest Score (0-100) for every snapshot date that has an earlier
+# snapshot of the same query, computed in one set-based pass. Each date is
+# compared with the previous one (LAG over the query's dates) on its top 10:
+# - New domains entering the top 10: 0-10 domains = 0-40 points
+# - Average rank improvement of domains on both days: -10 to +10 = 0-30 points
+# - Reshuffle frequency (matched domains / current domains): 0-1 = 0-30 points
+# Optional filters: $query, $snapshot_date; $only_missing skips dates that
+# already have a score (otherwise they are recomputed).
+INTEREST_SCORES_SQL = """
+    INSERT OR REPLACE INTO interest_scores 
+    (query, snapshot_date, interest_score, new_domains_count, avg_rank_improvement, reshuffle_frequency)
+    WITH dates AS (
+        SELECT 
+            query,
+            snapshot_date,
+            LAG(snapshot_date) OVER (PARTITION BY query ORDER BY snapshot_date) AS prev_date
+        FROM (
+            SELECT DISTINCT query, snapshot_date
+            FROM serp_snapshots
+            WHERE $query IS NULL OR query = $query
+        )
+    ),
+    pending AS (
+        SELECT d.query, d.snapshot_date, d.prev_date
+        FROM dates d
+        WHERE d.prev_date IS NOT NULL
+          AND ($snapshot_date IS NULL OR d.snapshot_date = $snapshot_date)
+          AND NOT ($only_missing AND EXISTS (
+              SELECT 1 FROM interest_scores s
+              WHERE s.query = d.query AND s.snapshot_date = d.snapshot_date
+          ))
+    ),
+    -- Only the pending dates and their previous dates are needed; scoring a
+    -- single snapshot then reads two days of results, not the whole history
+    needed_dates AS (
+        SELECT query, snapshot_date FROM pending
+        UNION
+        SELECT query, prev_date FROM pending
+    ),
+    top10 AS MATERIALIZED (
+        SELECT s.query, s.snapshot_date, s.domain, s.rank
+        FROM serp_snapshots s
+        SEMI JOIN needed_dates n
+            ON n.query = s.query AND n.snapshot_date = s.snapshot_date
+        WHERE s.rank <= 10
+          AND ($query IS NULL OR s.query = $query)
+    ),
+    current_domains AS (
+        SELECT DISTINCT p.query, p.snapshot_date, t.domain
+        FROM pending p
+        JOIN top10 t ON t.query = p.query AND t.snapshot_date = p.snapshot_date
+    ),
+    prev_domains AS (
+        SELECT DISTINCT p.query, p.snapshot_date, t.domain
+        FROM pending p
+        JOIN top10 t ON t.query = p.query AND t.snapshot_date = p.prev_date
+    ),
+    new_domains AS (
+        SELECT query, snapshot_date, COUNT(*) AS n
+        FROM (SELECT * FROM current_domains EXCEPT SELECT * FROM prev_domains)
+        GROUP BY query, snapshot_date
+    ),
+    domain_counts AS (
+        SELECT query, snapshot_date, COUNT(*) AS n
+        FROM current_domains
+        GROUP BY query, snapshot_date
+    ),
+    rank_changes AS (
+        SELECT 
+            p.query,
+            p.snapshot_date,
+            COUNT(*) AS n,
+            AVG(prev.rank - cur.rank) AS avg_improvement
+        FROM pending p
+        JOIN top10 cur ON cur.query = p.query AND cur.snapshot_date = p.snapshot_date
+        JOIN top10 prev ON prev.query = p.query AND prev.snapshot_date = p.prev_date
+            AND prev.domain = cur.domain
+        GROUP BY p.query, p.snapshot_date
+    ),
+    components AS (
+        SELECT 
+            p.query,
+            p.snapshot_date,
+            COALESCE(nd.n, 0) AS new_domains_count,
+            COALESCE(rc.avg_improvement, 0.0) AS avg_rank_improvement,
+            CAST(COALESCE(rc.n, 0) AS DOUBLE) / GREATEST(COALESCE(dc.n, 0), 1) AS reshuffle_frequency
+        FROM pending p
+        LEFT JOIN new_domains nd USING (query, snapshot_date)
+        LEFT JOIN domain_counts dc USING (query, snapshot_date)
+        LEFT JOIN rank_changes rc USING (query, snapshot_date)
+    )
+    SELECT 
+        query,
+        snapshot_date,
+        LEAST(new_domains_count * 4, 40)
+            + LEAST(GREATEST((avg_rank_improvement + 10) / 20 * 30, 0), 30)
+            + reshuffle_frequency * 30 AS interest_score,
+        new_domains_count,
+        avg_rank_improvement,
+        reshuffle_frequency
+    FROM components
+"""
 
 
 class DuckDBManager:
@@ -20,11 +167,27 @@ class DuckDBManager:
     # initialize the schema for the database
     def _create_schema(self):
         """Create schema for SERP snapshots"""
+        # All DDL commits together: one WAL flush instead of one per statement,
+        # and an interrupted first run leaves no half-built schema
+        self.conn.execute("BEGIN TRANSACTION")
+        try:
+            self._create_tables()
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+    
+    def _create_tables(self):
+        """Create the sequence, tables and indexes (inside _create_schema's transaction)"""
+        self._create_snapshot_sequence()
+        
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS serp_snapshots (
-                snapshot_id BIGINT PRIMARY KEY,
+                snapshot_id BIGINT PRIMARY KEY DEFAULT nextval('serp_snapshot_seq'),
                 query TEXT NOT NULL,
                 snapshot_date DATE NOT NULL,
+                -- fetch time; constant per snapshot, so it stores as RLE runs
+                -- and analytics (which scan only snapshot_date) never read it
                 snapshot_timestamp TIMESTAMP NOT NULL,
                 url TEXT NOT NULL,
                 title TEXT,
@@ -54,6 +217,12 @@ class DuckDBManager:
             ON serp_snapshots(query, snapshot_date)
         """)
         
+        # Covers the top-10 lookups used for interest scores
+        self.conn.execute("""
+            CREATE INDEX IF NOT EXISTS idx_query_date_rank 
+            ON serp_snapshots(query, snapshot_date, rank)
+        """)
+        
         self.conn.execute("""
             CREATE INDEX IF NOT EXISTS idx_url_query 
             ON serp_snapshots(url, query)
@@ -64,194 +233,198 @@ class DuckDBManager:
             ON interest_scores(query, snapshot_date)
         """)
     
-    # inserting snapshots
-    def insert_snapshot(self, results: List[Dict[str, Any]], query: str, 
-                       snapshot_date: Optional[datetime] = None):
-        """Insert a daily snapshot of SERP results"""
+    # snapshot ids come from a sequence instead of MAX(snapshot_id) + 1
+    def _create_snapshot_sequence(self):
+        """Create serp_snapshot_seq, continuing after any ids in an existing table"""
+        seq_exists = self.conn.execute("""
+            SELECT COUNT(*) FROM duckdb_sequences() 
+            WHERE sequence_name = 'serp_snapshot_seq'
+        """).fetchone()[0]
+        if seq_exists:
+            return
+        
+        table_exists = self.conn.execute("""
+            SELECT COUNT(*) FROM duckdb_tables() 
+            WHERE table_name = 'serp_snapshots'
+        """).fetchone()[0]
+        if not table_exists:
+            self.conn.execute("CREATE SEQUENCE serp_snapshot_seq START 1")
+            return
+        
+        # Databases created before the sequence: start past the stored ids
+        # and attach the default to the existing column
+        max_id = self.conn.execute(
+            "SELECT COALESCE(MAX(snapshot_id), 0) FROM serp_snapshots"
+        ).fetchone()[0]
+        self.conn.execute(f"CREATE SEQUENCE serp_snapshot_seq START {max_id + 1}")
+        self.conn.execute("""
+            ALTER TABLE serp_snapshots 
+            ALTER COLUMN snapshot_id SET DEFAULT nextval('serp_snapshot_seq')
+        """)
+    
+    # building table columns for one snapshot
+    def _append_snapshot(self, columns: Dict[str, list], results: List[Dict[str, Any]], query: str,
+                         snapshot_date: Optional[datetime]) -> date:
+        """Append one snapshot's rows to per-column lists; returns its date"""
         if snapshot_date is None:
             snapshot_date = datetime.now()
         
         snapshot_timestamp = snapshot_date
         snapshot_date_only = snapshot_date.date() if hasattr(snapshot_date, 'date') else snapshot_date
         
-        if not results:
-            return
-        
-        def extract_domain(url: str) -> str:
-            if not url:
-                return ""
-            try:
-                from urllib.parse import urlparse
-                parsed = urlparse(url)
-                return parsed.netloc.replace("www.", "")
-            except:
-                return ""
+        # Column-at-a-time; the url/link and snippet/description fallbacks only
+        # look up the second key when the first is missing
+        count = len(results)
+        columns['query'].extend([query] * count)
+        columns['snapshot_date'].extend([snapshot_date_only] * count)
+        columns['snapshot_timestamp'].extend([snapshot_timestamp] * count)
+        columns['url'].extend([r['url'] if 'url' in r else r.get('link', '') for r in results])
+        columns['title'].extend([r.get('title', '') for r in results])
+        columns['snippet'].extend([r['snippet'] if 'snippet' in r else r.get('description', '')
+                                   for r in results])
+        columns['rank'].extend(range(1, count + 1))
         
-        # Get max snapshot_id
-        max_id_result = self.conn.execute(
-            "SELECT COALESCE(MAX(snapshot_id), 0) FROM serp_snapshots"
-        ).fetchone()
-        next_id = (max_id_result[0] if max_id_result else 0) + 1
-        
-        rows = []
-        for idx, result in enumerate(results):
-            url = result.get('url', result.get('link', ''))
-            domain = extract_domain(url)
-            
-            rows.append({
-                'snapshot_id': next_id + idx,
-                'query': query,
-                'snapshot_date': snapshot_date_only,
-                'snapshot_timestamp': snapshot_timestamp,
-                'url': url,
-                'title': result.get('title', ''),
-                'snippet': result.get('snippet', result.get('description', '')),
-                'domain': domain,
-                'rank': idx + 1
-            })
+        return snapshot_date_only
+    
+    def _insert_columns(self, columns: Dict[str, list]):
+        """Insert prepared column lists in one statement, ignoring duplicates"""
+        import pyarrow as pa
+        batch = pa.table(columns)
         
-        import pandas as pd
-        df = pd.DataFrame(rows)
+        # DuckDB scans the registered Arrow table without copying it
+        self.conn.register('batch', batch)
+        try:
+            # Skip duplicates with one hash anti-join against the stored keys
+            # instead of per-row unique-index probes; within the batch the
+            # best-ranked row per key wins. UNIQUE stays as a safety net.
+            # Rows land clustered by (query, snapshot_date, rank) so row-group
+            # min/max stats can skip non-matching dates and ranks > 10.
+            # snapshot_id is left to its sequence default; domains are extracted
+            # vectorized over the whole url column
+            column_list = ', '.join(SNAPSHOT_COLUMNS)
+            batch_columns = ', '.join(f'b.{name}' for name in SNAPSHOT_COLUMNS)
+            self.conn.execute(f"""
+                INSERT INTO serp_snapshots ({column_list}, domain)
+                WITH staged AS (
+                    SELECT {column_list}, {DOMAIN_SQL} as domain FROM batch
+                    QUALIFY row_number() OVER (
+                        PARTITION BY query, snapshot_date, url ORDER BY rank
+                    ) = 1
+                )
+                SELECT {batch_columns}, b.domain
+                FROM staged b
+                LEFT JOIN serp_snapshots s
+                    ON b.query = s.query
+                    AND b.snapshot_date = s.snapshot_date
+                    AND b.url = s.url
+                WHERE s.url IS NULL
+                ORDER BY b.query, b.snapshot_date, b.rank
+            """)
+        finally:
+            self.conn.unregister('batch')
+    
+    # inserting snapshots
+    def insert_snapshot(self, results: List[Dict[str, Any]], query: str, 
+                       snapshot_date: Optional[datetime] = None):
+        """Insert a daily snapshot of SERP results"""
+        if not results:
+            return
         
-        # Insert or ignore duplicates
-        self.conn.execute("""
-            INSERT OR IGNORE INTO serp_snapshots 
-            SELECT * FROM df
-        """)
+        columns = {name: [] for name in SNAPSHOT_COLUMNS}
+        snapshot_date_only = self._append_snapshot(columns, results, query, snapshot_date)
+        self._insert_columns(columns)
         
         # Calculate and store interest score
         self._calculate_interest_score(query, snapshot_date_only)
+        self._materialize_analytics(query)
     
-    # calculating the interest score (internal)
-    def _calculate_interest_score(self, query: str, snapshot_date):
-        """Calculate Search Interest Score (0-100) based on SERP movement"""
-        # Get previous day's snapshot for comparison
-        prev_date_result = self.conn.execute("""
-            SELECT MAX(snapshot_date) 
-            FROM serp_snapshots 
-            WHERE query = ? 
-              AND snapshot_date < ?
-        """, [query, snapshot_date]).fetchone()
+    # inserting many snapshots at once
+    def insert_snapshots_bulk(self, batch: List[Tuple[str, Optional[datetime], List[Dict[str, Any]]]]):
+        """Insert many (query, snapshot_date, results) snapshots with a single INSERT"""
+        columns = {name: [] for name in SNAPSHOT_COLUMNS}
+        scored = []
+        for query, snapshot_date, results in batch:
+            if not results:
+                continue
+            snapshot_date_only = self._append_snapshot(columns, results, query, snapshot_date)
+            scored.append((query, snapshot_date_only))
         
-        if not prev_date_result or not prev_date_result[0]:
-            # First snapshot, no comparison possible
+        if not scored:
             return
         
-        prev_date = prev_date_result[0]
-        
-        # Get current top 10 domains
-        current_domains = self.conn.execute("""
-            SELECT DISTINCT domain 
-            FROM serp_snapshots 
-            WHERE query = ? 
-              AND snapshot_date = ?
-              AND rank <= 10
-        """, [query, snapshot_date]).fetchall()
-        current_domains_set = {row[0] for row in current_domains}
+        self._insert_columns(columns)
         
-        # Get previous top 10 domains
-        prev_domains = self.conn.execute("""
-            SELECT DISTINCT domain 
-            FROM serp_snapshots 
-            WHERE query = ? 
-              AND snapshot_date = ?
-              AND rank <= 10
-        """, [query, prev_date]).fetchall()
-        prev_domains_set = {row[0] for row in prev_domains}
-        
-        # Count new domains entering top 10
-        new_domains = current_domains_set - prev_domains_set
-        new_domains_count = len(new_domains)
+        # Scores only look back at earlier dates, so compute them after the load:
+        # one set-based pass per touched query (re-scoring all of its dates also
+        # covers snapshots loaded in between already-scored ones)
+        for query in dict.fromkeys(query for query, _ in scored):
+            self._store_interest_scores(query=query, only_missing=False)
+            self._materialize_analytics(query)
+    
+    # materializing per-query analytics input to Parquet
+    def _materialize_analytics(self, query: str):
+        """Write the query's per-URL rank history (with previous rank/date) to Parquet"""
+        version = tuple(self.conn.execute(ANALYTICS_VERSION_SQL, [query]).fetchone())
+        path = analytics_cache_path(self.db_path, query, version)
+        cache_dir = os.path.dirname(path)
+        os.makedirs(cache_dir, exist_ok=True)
         
-        # Calculate average rank improvement for existing domains
-        rank_changes = self.conn.execute("""
-            WITH current_ranks AS (
-                SELECT domain, rank
+        # Write under a temporary name and rename, so readers never see a
+        # partial file; COPY can't bind its target, so quotes are doubled
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        target = tmp_path.replace("'", "''")
+        self.conn.execute(f"""
+            COPY (
+                SELECT 
+                    url,
+                    domain,
+                    snapshot_date,
+                    rank,
+                    LAG(rank) OVER w as prev_rank,
+                    LAG(snapshot_date) OVER w as prev_date
                 FROM serp_snapshots
-                WHERE query = ? AND snapshot_date = ? 
-                  AND rank <= 10
-            ),
-            prev_ranks AS (
-                SELECT domain, rank
-                FROM serp_snapshots
-                WHERE query = ? AND snapshot_date = ?
-                  AND rank <= 10
-            )
-            SELECT 
-                c.domain,
-                c.rank as current_rank,
-                p.rank as prev_rank,
-                (p.rank - c.rank) as rank_improvement
-            FROM current_ranks c
-            JOIN prev_ranks p ON c.domain = p.domain
-        """, [query, snapshot_date, query, prev_date]).fetchall()
-        
-        if rank_changes:
-            avg_rank_improvement = sum(row[3] for row in rank_changes) / len(rank_changes)
-        else:
-            avg_rank_improvement = 0.0
-        
-        # Calculate reshuffle frequency (how many domains changed position)
-        reshuffle_count = len(rank_changes)
-        reshuffle_frequency = reshuffle_count / max(len(current_domains_set), 1)
-        
-        # Normalize to 0-100 score
-        # I'm calculating a final score from 3 weighted sub-scores:
-        # - New domains: 0-10 domains = 0-40 points
-        # - Rank improvement: -10 to +10 = 0-30 points (normalized)
-        # - Reshuffle frequency: 0-1 = 0-30 points
-        
-        new_domains_score = min(new_domains_count * 4, 40)  # Max 40 points
-        rank_improvement_score = min(max((avg_rank_improvement + 10) / 20 * 30, 0), 30)  # Max 30 points
-        reshuffle_score = reshuffle_frequency * 30  # Max 30 points
-        
-        interest_score = new_domains_score + rank_improvement_score + reshuffle_score
+                WHERE query = ?
+                WINDOW w AS (PARTITION BY url ORDER BY snapshot_date)
+                ORDER BY snapshot_date, url
+            ) TO '{target}' (FORMAT PARQUET, COMPRESSION ZSTD)
+        """, [query])
+        os.replace(tmp_path, path)
         
-        # Store interest score
-        self.conn.execute("""
-            INSERT OR REPLACE INTO interest_scores 
-            (query, snapshot_date, interest_score, new_domains_count, avg_rank_improvement, reshuffle_frequency)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, [query, snapshot_date, interest_score, new_domains_count, avg_rank_improvement, reshuffle_frequency])
+        # Drop the query's older versions
+        prefix = _analytics_cache_prefix(query)
+        current = os.path.basename(path)
+        for name in os.listdir(cache_dir):
+            if name.startswith(prefix) and name.endswith('_volatility.parquet') and name != current:
+                os.remove(os.path.join(cache_dir, name))
+    
+    def clear_analytics_cache(self):
+        """Remove this database's materialized analytics files (e.g. after deleting snapshots)"""
+        cache_dir = analytics_cache_dir(self.db_path)
+        if not os.path.isdir(cache_dir):
+            return
+        for name in os.listdir(cache_dir):
+            if name.endswith('.parquet'):
+                os.remove(os.path.join(cache_dir, name))
+    
+    # calculating the interest score (internal)
+    def _calculate_interest_score(self, query: str, snapshot_date):
+        """Calculate Search Interest Score (0-100) based on SERP movement"""
+        self._store_interest_scores(query=query, snapshot_date=snapshot_date, only_missing=False)
+    
+    def _store_interest_scores(self, query: Optional[str] = None, snapshot_date=None,
+                               only_missing: bool = True) -> int:
+        """Score every matching snapshot date that has an earlier one; returns rows written"""
+        result = self.conn.execute(INTEREST_SCORES_SQL, {
+            'query': query,
+            'snapshot_date': snapshot_date,
+            'only_missing': only_missing,
+        }).fetchone()
+        return result[0] if result else 0
     
     # calculating the interest score for all snapshots
     def calculate_all_interest_scores(self, query: Optional[str] = None):
-        """Calculate interest scores for all existing snapshots"""
-        # Get all unique query/date combinations that don't have scores yet
-        if query:
-            dates_query = """
-                SELECT DISTINCT query, snapshot_date
-                FROM serp_snapshots
-                WHERE query = ?
-                ORDER BY query, snapshot_date
-            """
-            snapshot_dates = self.conn.execute(dates_query, [query]).fetchall()
-        else:
-            dates_query = """
-                SELECT DISTINCT query, snapshot_date
-                FROM serp_snapshots
-                ORDER BY query, snapshot_date
-            """
-            snapshot_dates = self.conn.execute(dates_query).fetchall()
-        
-        calculated = 0
-        for query_name, snapshot_date in snapshot_dates:
-            try:
-                # Check if score already exists
-                existing = self.conn.execute("""
-                    SELECT COUNT(*) FROM interest_scores
-                    WHERE query = ? AND snapshot_date = ?
-                """, [query_name, snapshot_date]).fetchone()
-                
-                if existing[0] == 0:
-                    # Calculate score
-                    self._calculate_interest_score(query_name, snapshot_date)
-                    calculated += 1
-            except Exception as e:
-                # Skip if calculation fails (e.g., no previous snapshot)
-                continue
-        
-        return calculated
+        """Calculate interest scores for all existing snapshots that don't have one yet"""
+        return self._store_interest_scores(query=query)
     
     # getting the total number of snapshots
     def get_snapshot_count(self) -> int:
@@ -259,6 +432,14 @@ class DuckDBManager:
         result = self.conn.execute("SELECT COUNT(*) FROM serp_snapshots").fetchone()
         return result[0] if result else 0
     
+    # per-thread handle on the same database
+    def cursor(self) -> "DuckDBManager":
+        """Return a manager bound to a new cursor on this connection (one per worker thread)"""
+        worker = object.__new__(DuckDBManager)
+        worker.db_path = self.db_path
+        worker.conn = self.conn.cursor()
+        return worker
+    
     # close database connection
     def close(self):
         """Close database connection"""
@@ -2,52 +2,85 @@
 SERP snapshot fetcher
 """
 
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Optional
 
-from serp_client import BrightDataClient
-from duckdb_manager import DuckDBManager
+from .serp_client import BrightDataClient
+from .duckdb_manager import DuckDBManager
 
 
-def fetch_snapshots(keywords: List[str], num_results: int = 10, delay: float = 1.0):
+class RateLimiter:
+    """Space out call start times by a fixed interval across threads"""
+    
+    def __init__(self, interval: float):
+        self.interval = max(interval, 0.0)
+        self._lock = threading.Lock()
+        self._next_slot = time.monotonic()
+    
+    def wait(self):
+        """Block until this caller's slot comes up"""
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def fetch_snapshots(keywords: List[str], num_results: int = 10, delay: float = 1.0,
+                    max_workers: int = 8):
     """
     Fetch SERP snapshots for keywords and store in DuckDB
     
     Args:
         keywords: List of search keywords
         num_results: Number of results per keyword
-        delay: Delay between API calls (seconds)
+        delay: Minimum delay between the start of API calls (seconds)
+        max_workers: Maximum number of API calls in flight at once
     """
     client = BrightDataClient()
+    limiter = RateLimiter(delay)
     
-    with DuckDBManager() as db:
+    def fetch(keyword: str):
+        # Runs on a worker thread; errors are reported alongside the keyword
+        limiter.wait()
+        try:
+            serp_data = client.search(keyword, num_results=num_results)
+        except Exception as e:
+            return keyword, None, e
+        
+        # Extract organic results
+        organic_results = []
+        if isinstance(serp_data, dict) and 'organic' in serp_data:
+            organic_results = serp_data['organic']
+        return keyword, organic_results, None
+    
+    with client, DuckDBManager() as db:
         print(f"Fetching snapshots for {len(keywords)} keywords...")
         
-        for idx, keyword in enumerate(keywords):
-            try:
-                # Fetch SERP results
-                serp_data = client.search(keyword, num_results=num_results)
-                
-                # Extract organic results
-                organic_results = []
-                if isinstance(serp_data, dict) and 'organic' in serp_data:
-                    organic_results = serp_data['organic']
+        # HTTP calls overlap on the pool; inserts stay on this thread because
+        # the DuckDB connection is a single writer
+        workers = max(1, min(max_workers, len(keywords)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for idx, (keyword, organic_results, error) in enumerate(executor.map(fetch, keywords)):
+                if error is not None:
+                    print(f"Error fetching '{keyword}': {error}")
+                    continue
                 
-                if organic_results:
-                    # Insert snapshot
-                    db.insert_snapshot(organic_results, keyword)
-                    print(f"[{idx+1}/{len(keywords)}] '{keyword}': {len(organic_results)} results")
-                else:
-                    print(f"[{idx+1}/{len(keywords)}] '{keyword}': No results found")
+                try:
+                    if organic_results:
+                        # Insert snapshot
+                        db.insert_snapshot(organic_results, keyword)
+                        print(f"[{idx+1}/{len(keywords)}] '{keyword}': {len(organic_results)} results")
+                    else:
+                        print(f"[{idx+1}/{len(keywords)}] '{keyword}': No results found")
                 
-                # Rate limiting
-                if idx < len(keywords) - 1:
-                    time.sleep(delay)
-            
-            except Exception as e:
-                print(f"Error fetching '{keyword}': {e}")
-                continue
+                except Exception as e:
+                    print(f"Error fetching '{keyword}': {e}")
+                    continue
         
         total = db.get_snapshot_count()
         print(f"\nTotal snapshots in database: {total}")
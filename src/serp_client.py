@@ -4,8 +4,9 @@ Bright Data SERP API client
 
 import os
 import json
-import requests
+import httpx
 from typing import Dict, Any, Optional
+from urllib.parse import quote
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -39,11 +40,17 @@ class BrightDataClient:
                 "BRIGHT_DATA_ZONE must be provided via constructor or environment variable"
             )
         
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {self.api_key}'
-        })
+        # One pooled HTTP/2 client, so concurrent searches multiplex over a
+        # kept-alive TLS connection instead of handshaking per request
+        self.client = httpx.Client(
+            http2=True,
+            headers={
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {self.api_key}'
+            },
+            timeout=30,
+            limits=httpx.Limits(max_keepalive_connections=16)
+        )
     
     def search(
         self,
@@ -55,7 +62,7 @@ class BrightDataClient:
         """Execute a Google search via Bright Data SERP API"""
         search_url = (
             f"https://www.google.com/search"
-            f"?q={requests.utils.quote(query)}"
+            f"?q={quote(query)}"
             f"&num={num_results}"
             f"&brd_json=1"
         )
@@ -75,10 +82,9 @@ class BrightDataClient:
             payload['country'] = target_country
         
         try:
-            response = self.session.post(
+            response = self.client.post(
                 self.api_endpoint,
-                json=payload,
-                timeout=30
+                json=payload
             )
             response.raise_for_status()
             result = response.json()
@@ -92,10 +98,20 @@ class BrightDataClient:
             
             return result
             
-        except requests.exceptions.HTTPError as e:
+        except httpx.HTTPStatusError as e:
             error_msg = f"Search request failed with HTTP {e.response.status_code}"
             if e.response.text:
                 error_msg += f": {e.response.text[:200]}"
             raise RuntimeError(error_msg) from e
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise RuntimeError(f"Search request failed: {e}") from e
+    
+    def close(self):
+        """Close pooled HTTP connections"""
+        self.client.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()